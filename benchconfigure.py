@@ -0,0 +1,140 @@
+# This file is part of TALER
+# (C) 2019 GNUnet e.V.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# SPDX-License-Identifier: 0BSD
+
+"""
+Benchmark for the configure engine in talerbuildconfig.
+
+Builds a synthetic environment with many $PATH directories full of
+executables, plus fake node, yarn, python3.x, yapf-3.x, ... shims that
+sleep for a configurable time before answering, and then measures
+running testconfigure.py in it end to end.  The "cold" case starts
+without a config.cache, the "warm" case reuses the one from the
+previous run.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# name -> shell snippet that answers the probes of talerbuildconfig
+shims = {
+    "node": "echo v14.17.0",
+    "yarn": "echo 1.22.19",
+    "pybabel": "echo pybabel",
+    "find": ":",
+    "xargs": ":",
+    "msgmerge": ":",
+    "true": ":",
+}
+for minor in range(7, 10):
+    shims[f"python3.{minor}"] = (
+        f"echo '{{\"version\": \"3.{minor}.0\", "
+        f"\"version_info\": [3, {minor}, 0], "
+        f"\"executable\": \"'\"$0\"'\", \"paths\": {{}}, \"dists\": {{}}}}'"
+    )
+    shims[f"yapf-3.{minor}"] = "echo yapf 0.30.0"
+
+
+def write_script(path, body):
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + body + "\n")
+    os.chmod(path, 0o755)
+
+
+def make_env(root, ndirs, nexecutables, delay):
+    """Create the synthetic $PATH below 'root' and return it."""
+    dirs = []
+    for i in range(ndirs):
+        d = os.path.join(root, f"bin{i:04d}")
+        os.mkdir(d)
+        dirs.append(d)
+    for i in range(nexecutables):
+        write_script(os.path.join(dirs[i % ndirs], f"filler{i}"), ":")
+    # The shims go into the last directory, so that every lookup has
+    # to get past all the others.
+    sleep = f"{shutil.which('sleep')} {delay}\n" if delay > 0 else ""
+    for name, body in shims.items():
+        write_script(os.path.join(dirs[-1], name), sleep + body)
+    return os.pathsep.join(dirs)
+
+
+def configure(workdir, path, extra_args):
+    env = dict(os.environ, PATH=path, PYTHONPATH=here)
+    env.pop("BROWSER", None)
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(here, "testconfigure.py")] + extra_args,
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--dirs", type=int, default=200, help="number of $PATH directories"
+    )
+    parser.add_argument(
+        "--executables",
+        type=int,
+        default=5000,
+        help="number of filler executables"
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="startup delay of the fake tools (seconds)"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="runs per case")
+    parser.add_argument(
+        "configure_args",
+        nargs="*",
+        help="extra arguments for testconfigure.py, e.g. -j4"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="benchconfigure.") as root:
+        path = make_env(root, args.dirs, args.executables, args.delay)
+        workdir = os.path.join(root, "work")
+        os.mkdir(workdir)
+        cache = os.path.join(workdir, "config.cache")
+        cases = {"cold": [], "warm": []}
+        for _ in range(args.runs):
+            if os.path.exists(cache):
+                os.unlink(cache)
+            cases["cold"].append(
+                configure(workdir, path, ["-C"] + args.configure_args)
+            )
+            cases["warm"].append(
+                configure(workdir, path, ["-C"] + args.configure_args)
+            )
+
+    print(
+        f"{args.dirs} PATH directories, {args.executables} executables, "
+        f"{args.delay}s tool delay"
+    )
+    print(f"{'case':<6} {'min':>9} {'median':>9}")
+    for case, times in cases.items():
+        print(
+            f"{case:<6} {min(times):>8.3f}s {statistics.median(times):>8.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -70,7 +70,10 @@ existence_python()
     # we could check the return value here via || echo "blafoo"
     # or fail anyway once configure.py is invoked because we
     # don't have python if we reach the point to fail.
-    PYTHON=$($python -c 'import sys; print(sys.executable)')
+    # The bytecode tag selects the bundle built by bootstrap.
+    python_info=$($python -c 'import sys; print(sys.implementation.cache_tag, sys.executable)')
+    PYTHON_CACHE_TAG=${python_info%% *}
+    PYTHON=${python_info#* }
 }
 
 existence_python
@@ -26,16 +26,15 @@ if not (sys.version_info.major == 3 and sys.version_info.minor >= 7):
     print("You are using Python {}.{}.".format(sys.version_info.major, sys.version_info.minor))
     sys.exit(1)
 
+# Only cheap modules are imported here.  Everything else (argparse,
+# subprocess, json, semver, ...) is imported where it is needed, so that
+# a configure run does not pay for features it does not use.
 from abc import ABC
-import argparse
+import io
 import os
 import sys
-import shlex
-import logging
-from distutils.spawn import find_executable
-import subprocess
-from dataclasses import dataclass
-import semver
+import threading
+import time
 
 """
 This module aims to replicate a small GNU Coding Standards
@@ -52,113 +51,1467 @@ GNU Make format.
 """
 
 # Should be incremented each time we add some functionality
-serialversion = 2
+serialversion = 3
+
+# Version of the config.cache and probe snapshot formats, incremented
+# when their entries change meaning.
+_cacheversion = 1
 
 
 # TODO: We need a smallest version argument.
 
+class ConfigureError(Exception):
+    """
+    Configure failed.  'messages' are the lines explaining why, as
+    printed by BuildConfig.configure.
+    """
+
+    def __init__(self, msg, messages=()):
+        super().__init__(msg)
+        self.messages = list(messages)
+
+
+class ToolNotFoundError(ConfigureError):
+    """A required tool is not available."""
+
+
+class ToolVersionError(ConfigureError):
+    """A tool does not have the required version."""
+
+
+class ToolTimeoutError(ConfigureError):
+    """The probes of a tool did not finish in time."""
+
+
+class UsageError(ConfigureError):
+    """The configure arguments are invalid."""
+
+
+class ConfigureExit(ConfigureError):
+    """
+    Configure stopped early after doing what was asked, as for
+    --help.  'status' is the exit status for the process.
+    """
+
+    def __init__(self, status=0):
+        super().__init__(f"exit status {status}")
+        self.status = status
+
+
 class Tool(ABC):
+    # Environment variables that influence the result of check().
+    cache_env = ()
+    # Names of the tools that must be available before this one
+    # can be checked.
+    depends = ()
+    # Seconds the probes of check() may take, instead of the
+    # --probe-timeout default.
+    timeout = None
+    # Python distributions whose versions check() looks up, so that
+    # the interpreter probe of PythonTool reports them too.
+    python_dists = ()
+    # Whether a cached result is invalidated by changes to the
+    # executable it found, or for a failed check, to the $PATH
+    # directories.  Tools whose result is not an executable cover what
+    # it depends on in fingerprint() instead.
+    fingerprint_executable = True
+
     def args(self):
         ...
 
     def check(self, buildconfig):
         ...
 
+    def fingerprint(self, buildconfig):
+        """
+        Return extra JSON data that must not change for a cached result
+        of check() to stay valid, or None.
+        """
+        return None
+
+    def cacheable(self, buildconfig):
+        """
+        Return False if the result of the check() that just ran must
+        not be kept in config.cache or a probe snapshot.
+        """
+        return True
+
+
+class ProbeState:
+    """
+    Memo table of probe results, see BuildConfig._memoize.  Several
+    BuildConfig instances can share one, so that configuring many
+    projects in one process probes everything only once.
+    """
 
-class BuildConfig:
     def __init__(self):
+        self.lock = threading.Lock()
+        self.memo = {}
+
+
+class ConfigureResult:
+    """The results of a successful BuildConfig.configure call."""
+
+    def __init__(self, buildconfig):
+        self.directory = buildconfig.directory
+        self.args = buildconfig.args
+        # Pairs of (path, version) by tool name
+        self.tools = dict(buildconfig.tool_results)
+        self.variables = dict(buildconfig._make_variables())
+        self.variants = list(buildconfig.variants)
+
+
+class BuildConfig:
+    def __init__(self, probe_state=None):
         # Pairs of (key, value) for config.mk variables
         self.make_variables = []
         self.tools = []
-        self.tool_results = {}
         self.args = None
         self.prefix_enabled = False
         self.variant_enabled = False
         self.configmk_enabled = False
+        self.configjson_enabled = False
+        self.configpy_enabled = False
+        # Pairs of (template, output) to substitute @name@ in
+        self.config_files = []
+        # Lists of [name, directory, patterns, exclude] for inventory.mk
+        self.inventories = []
+        # A probe_state given here is shared with other instances, and
+        # kept across configure runs.
+        self.probe_state = probe_state
+        self._shared_probe_state = probe_state is not None
+        self._lock = threading.Lock()
+        # Directory the output files are written to
+        self.directory = ""
+        self._output = print
+        self._reset()
+
+    def _reset(self):
+        """Set up the state of a configure run."""
+        if not self._shared_probe_state:
+            self.probe_state = ProbeState()
+        self.tool_results = {}
+        # Lists of (key, value) config.mk variables set by each tool,
+        # by tool name
+        self.tool_variables = {}
+        # Pairs of (variant, prefix) to write config.mk for
+        self.variants = []
+        self._local = threading.local()
+        self.cache_file = None
+        self._cache = {}
+        self.trace_file = None
+        self.trace = None
+        # Outcomes of tool checks by tool name, as saved in probe
+        # snapshots, and the ones loaded from a snapshot.
+        self._outcomes = {}
+        self._snapshot = {}
+        # Number of lookups answered from the memo table
+        self.memo_hits = 0
+        # Process groups of the running probes, mapped to the position
+        # of their tool in _ordered_tools(), and the position from
+        # which tools are cancelled after a failure, if any
+        self._running = {}
+        self._cancel_from = None
+        # time.monotonic() by which all probes must be done, if any
+        self._deadline = None
+        # Everything for config.log is collected here, and written
+        # out once at the end of configure.
+        self._log = io.StringIO()
+        # ProbeClient of the probe daemon, if one is used
+        self.probe_client = None
 
     def add_tool(self, tool):
+        """
+        Add a tool to check.  The checks run one after another, unless
+        configure is run with --jobs, which runs the checks whose
+        dependencies are done concurrently on a thread pool.
+        """
         if isinstance(tool, Tool):
             self.tools.append(tool)
         else:
             raise Exception("Not a tool instance: " + repr(tool))
 
+    def add_config_file(self, template, output=None):
+        """
+        Generate 'output' from 'template', replacing each @name@ with
+        the configure result 'name': prefix, variant, a tool or a
+        config.mk variable.  'output' defaults to the template name
+        without its .in suffix.
+        """
+        if output is None:
+            if not template.endswith(".in"):
+                raise Exception("No output name for config file: " + template)
+            output = template[:-3]
+        self.config_files.append((template, output))
+
+    def add_inventory(self, name, directory, patterns=("*",), exclude=()):
+        """
+        Set the config.mk variable 'name' to the files below 'directory'
+        whose names match one of the glob 'patterns', skipping the
+        subdirectories named in 'exclude'.  This replaces $(shell find
+        ...) in Makefiles, which runs again for every make.
+
+        The lists go into inventory.mk, which config.mk includes.  It
+        has a rule to update itself when a directory in the trees
+        changes, so make only looks at the directory mtimes.
+        """
+        self.inventories.append(
+            [name, directory, list(patterns), list(exclude)]
+        )
+
     def _set_tool(self, name, value, version=None):
         self.tool_results[name] = (value, version)
 
+    def _memoize(self, key, fn, files=(), shared=True):
+        """
+        Return fn(), computing it only once per configure run for
+        'key', even when several tools ask for it concurrently.
+
+        With a probe daemon, a 'shared' result is also reused by other
+        configure runs on this host, until one of 'files' changes.
+        'files' may also be a function returning them for the result.
+        """
+        state = self.probe_state
+        with state.lock:
+            cell = state.memo.get(key)
+            if cell is None:
+                cell = state.memo[key] = [threading.Lock(), False, None]
+            else:
+                self.memo_hits += 1
+        with cell[0]:
+            if not cell[1]:
+                if shared and self.probe_client is not None:
+                    cell[2] = self.probe_client.memoize(key, fn, files)
+                else:
+                    cell[2] = fn()
+                cell[1] = True
+            return cell[2]
+
+    def which(self, name):
+        """Look up 'name' in $PATH, using the probe daemon if there is one."""
+        if self.probe_client is not None and os.sep not in name:
+            return self.probe_client.which(name)
+        return which(name)
+
+    def existence(self, name):
+        # The answer depends on $PATH, so it is not shared with other
+        # configure runs; the daemon's PATH index is used anyway.
+        return self._memoize(
+            ("existence", name),
+            lambda: self.which(name) is not None,
+            shared=False,
+        )
+
+    def python_info(self, interpreter):
+        """
+        Memoized version of the module-level python_info, reporting
+        the distributions that any of the tools look for.
+        """
+        exe = self.which(interpreter)
+        if exe is None:
+            return None
+        dists = self._python_dists()
+        # Installing or upgrading a distribution changes a directory
+        # on the interpreter's sys.path.  The current directory, which
+        # "python -c" puts there, changes all the time and is left out.
+        return self._memoize(
+            ("python", exe) + _python_env() + tuple(dists),
+            lambda: python_info(exe, dists),
+            files=lambda info: [exe] + _site_dirs(info),
+        )
+
+    def _python_dists(self):
+        return sorted(
+            {dist for tool in self.tools for dist in tool.python_dists}
+        )
+
+    def dist_version(self, executable, name):
+        """
+        Memoized version of the module-level dist_version.  If the
+        script 'executable' runs with the interpreter PythonTool
+        found, the answer comes from that interpreter's python_info.
+        """
+        exe = self.which(executable)
+        python = self.tool_results.get("python")
+        interpreter = exe and _shebang_interpreter(exe)
+        if (
+            python is not None
+            and interpreter is not None
+            and name in self._python_dists()
+        ):
+            info = self.python_info(python[0])
+            interpreter = self.which(interpreter)
+            if (
+                info is not None
+                and interpreter is not None
+                and os.path.realpath(interpreter)
+                == os.path.realpath(info["executable"])
+            ):
+                return info["dists"].get(name)
+        return self._memoize(
+            ("dist", exe or executable) + _python_env() + (name,),
+            lambda: dist_version(exe or executable, name),
+            files=[exe] if exe else [],
+        )
+
+    def query(self, probe):
+        """
+        Run 'probe' and return the facts its parsers extracted.  Each
+        command is spawned at most once per configure run; other tools
+        running the same command share its output.
+        """
+        exe = self.which(probe.argv[0])
+        key = ("spawn", exe or probe.argv[0]) + tuple(probe.argv[1:])
+        result = self._memoize(
+            key, lambda: run_probe(probe.argv), files=[exe] if exe else []
+        )
+        return probe.facts(result)
+
+    def _message(self, msg):
+        # While a tool is being checked, messages are buffered so that
+        # the output of concurrent checks does not interleave.
+        messages = getattr(self._local, "messages", None)
+        if messages is None:
+            self._output(msg)
+        else:
+            messages.append(msg)
+
+    def _warn(self, msg):
+        self._message(f"Warning: {msg}")
+
+    def _error(self, msg):
+        self._message(f"Error: {msg}")
+
+    def _version_error(self, msg):
+        """
+        Report that the tool being checked is available, but not in
+        the required version.  Its check() then returns False.
+        """
+        self._local.version_error = True
+        self._error(msg)
+
+    def _check(self, tool):
+        """Check a single tool, returning its result and messages."""
+        if self.trace is None:
+            return self._check_cached(tool)
+        import resource
+        record = {"tool": tool.name, "spawns": 0}
+        _probe_local.trace = record
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.monotonic()
+        try:
+            res, messages = self._check_cached(tool)
+        finally:
+            _probe_local.trace = None
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record["wall"] = time.monotonic() - start
+        record["child_cpu"] = (after.ru_utime - before.ru_utime) + (
+            after.ru_stime - before.ru_stime
+        )
+        record["ok"] = bool(res)
+        self.trace.append(record)
+        return res, messages
+
+    def _check_cached(self, tool):
+        entry = self._snapshot.get(tool.name)
+        if entry is not None:
+            if entry.get("fingerprint") != self._fingerprint(tool):
+                # The tool is configured differently than when the
+                # snapshot was saved, e.g. it checks other pkg-config
+                # modules.
+                self._log_lines([f"probe snapshot does not match {tool.name}"])
+                entry = None
+        if entry is None:
+            entry = self._cache.get(tool.name)
+            if entry is not None:
+                if entry["key"] != self._cache_key(tool, entry):
+                    entry = None
+        cacheable = True
+        if entry is not None:
+            if entry["result"] is not None:
+                self._set_tool(tool.name, *entry["result"])
+            res, messages = entry["ok"], entry["messages"]
+            self._local.version_error = entry.get("version_error", False)
+            if entry.get("variables"):
+                self.tool_variables[tool.name] = entry["variables"]
+        else:
+            messages = self._local.messages = []
+            self._local.variables = []
+            self._local.version_error = False
+            try:
+                res = tool.check(self)
+            finally:
+                self._local.messages = None
+            if self._local.variables:
+                self.tool_variables[tool.name] = self._local.variables
+            cacheable = tool.cacheable(self)
+            if self.cache_file is not None and cacheable:
+                self._cache_store(tool, bool(res), messages)
+        if not cacheable:
+            return res, messages
+        self._outcomes[tool.name] = {
+            "ok": bool(res),
+            "messages": messages,
+            "result": self.tool_results.get(tool.name) if res else None,
+            "variables": self.tool_variables.get(tool.name, []),
+            "version_error": self._local.version_error,
+        }
+        if self.args.save_probes is not None:
+            self._outcomes[tool.name]["fingerprint"] = self._fingerprint(tool)
+        return res, messages
+
+    def _fingerprint(self, tool):
+        # As it reads back from JSON, so it compares equal to the one
+        # in a snapshot.
+        import json
+        return json.loads(json.dumps(tool.fingerprint(self)))
+
+    def _add_make_variable(self, key, value):
+        """Add a config.mk variable from the check of the current tool."""
+        self._local.variables.append((key, value))
+
+    def _is_cancelled(self, position=None):
+        """Return True if the tool at 'position' was cancelled."""
+        if position is None:
+            position = getattr(_probe_local, "position", 0)
+        cancel_from = self._cancel_from
+        return cancel_from is not None and position >= cancel_from
+
+    def _probe_started(self, pid):
+        with self._lock:
+            self._running[pid] = getattr(_probe_local, "position", 0)
+        if self._is_cancelled():
+            _kill_group(pid)
+
+    def _probe_finished(self, pid):
+        with self._lock:
+            self._running.pop(pid, None)
+
+    def _cancel(self, position):
+        """
+        Kill the running probes of the tools after 'position', and make
+        their new ones fail.  The tools before it still finish, so the
+        first failure in tool order is the one that gets reported.
+        """
+        with self._lock:
+            if self._cancel_from is None or position < self._cancel_from:
+                self._cancel_from = position + 1
+            running = [
+                pid
+                for pid, pos in self._running.items()
+                if pos >= self._cancel_from
+            ]
+        for pid in running:
+            _kill_group(pid)
+
+    def _log_write(self, text):
+        with self._lock:
+            self._log.write(text)
+
+    def _log_output(self, line):
+        self._log_write(line + "\n")
+        self._user_output(line)
+
+    def _log_probe(self, argv, status, start, result=None):
+        """Record a probe command of the current tool check in config.log."""
+        import shlex
+        lines = [f"$ {' '.join(shlex.quote(a) for a in argv)}"]
+        lines.append(f"{status}, {time.monotonic() - start:.3f}s")
+        if result is not None:
+            streams = (("stdout", result.stdout), ("stderr", result.stderr))
+            for name, text in streams:
+                if text:
+                    lines.append(f"{name}:")
+                    lines.extend("| " + line for line in text.splitlines())
+        self._log_lines(lines)
+
+    def _log_lines(self, lines):
+        block = getattr(self._local, "log", None)
+        if block is None:
+            self._log_write("\n".join(lines) + "\n")
+        else:
+            block.extend(lines)
+
+    def _write_log(self):
+        filename = os.path.join(self.directory, "config.log")
+        try:
+            write_if_changed(filename, self._log.getvalue())
+        except OSError as e:
+            # Called on the way out of configure(), where it must not
+            # replace the error that is being raised.
+            self._user_output(f"Warning: cannot write {filename}: {e}")
+
+    def _probe(self, tool, position=0):
+        """
+        Check a tool and its version, returning (ok, messages, error).
+        'ok' is None if the check was cancelled, 'error' is the
+        ConfigureError to raise if it failed.  'position' is the place
+        of the tool in _ordered_tools().
+        """
+        timeout = tool.timeout
+        if timeout is None:
+            timeout = self.args.probe_timeout
+        deadline = time.monotonic() + timeout
+        if self._deadline is not None:
+            deadline = min(deadline, self._deadline)
+        _probe_local.deadline = deadline
+        _probe_local.owner = self
+        _probe_local.position = position
+        # The probes of each check are logged as one block, so that
+        # concurrent checks do not interleave in config.log.
+        self._local.log = [f"## checking {tool.name}"]
+        try:
+            res, messages = self._check(tool)
+        except ProbeTimeout as e:
+            messages = [f"Error: tool '{tool.name}' timed out: {e}"]
+            return False, messages, ToolTimeoutError(str(e), messages)
+        except ProbeCancelled:
+            return None, [], None
+        finally:
+            _probe_local.deadline = None
+            _probe_local.owner = None
+            _probe_local.position = 0
+            block = self._local.log
+            self._local.log = None
+            self._log_write("\n".join(block) + "\n")
+        messages = list(messages)
+        if not res and self._local.version_error:
+            error = ToolVersionError(
+                f"tool '{tool.name}' does not have the required version",
+                messages,
+            )
+            return False, messages, error
+        if not res:
+            messages.append(f"Error: tool '{tool.name}' not available")
+            if hasattr(tool, "hint"):
+                messages.append(f"Hint: {tool.hint}")
+            error = ToolNotFoundError(
+                f"tool '{tool.name}' not available", messages
+            )
+            return False, messages, error
+        if hasattr(tool, "version_spec"):
+            import semver
+            sv = semver.SimpleSpec(tool.version_spec)
+            path, version = self.tool_results[tool.name]
+            if not sv.match(semver.Version(version)):
+                messages.append(
+                    f"Error: Tool '{tool.name}' has version '{version}', "
+                    f"but we require '{tool.version_spec}'"
+                )
+                error = ToolVersionError(
+                    f"tool '{tool.name}' has version '{version}'", messages
+                )
+                return False, messages, error
+        return True, messages, None
+
+    def _check_requirements(self):
+        # Unlike other dependencies, the C compiler cannot be left out.
+        names = {tool.name for tool in self.tools}
+        for tool in self.tools:
+            if isinstance(tool, CompileCheck) and "cc" not in names:
+                msg = (
+                    f"tool '{tool.name}' is a CompileCheck, "
+                    "which requires CCompilerTool"
+                )
+                self._output(f"Error: {msg}")
+                raise ConfigureError(msg, [f"Error: {msg}"])
+
+    def _dependencies(self, tool):
+        # Dependencies on tools that are not registered are ignored.
+        names = {t.name: t for t in self.tools}
+        return [names[d] for d in tool.depends if d in names]
+
+    def _ordered_tools(self):
+        """
+        Return the tools in an order where each tool comes after its
+        dependencies, otherwise keeping the order of add_tool calls.
+        """
+        ordered = []
+        remaining = list(self.tools)
+        while remaining:
+            for tool in remaining:
+                if all(d in ordered for d in self._dependencies(tool)):
+                    ordered.append(tool)
+                    remaining.remove(tool)
+                    break
+            else:
+                names = ", ".join(t.name for t in remaining)
+                raise Exception("Dependency cycle between tools: " + names)
+        return ordered
+
+    def _skip(self, tool, outcomes):
+        """Return the outcome for 'tool' if a dependency failed, else None."""
+        for dep in self._dependencies(tool):
+            if not outcomes[dep.name][0]:
+                msg = f"tool '{tool.name}' skipped, it requires '{dep.name}'"
+                return False, [f"Error: {msg}"], ToolNotFoundError(msg)
+        return None
+
+    def _probe_all(self, jobs):
+        """
+        Probe all tools, yielding (tool, (ok, messages, error)) with
+        dependencies first.  With more than one job, tools whose
+        dependencies are done are probed concurrently.
+        """
+        tools = self._ordered_tools()
+        outcomes = {}
+        if jobs <= 1:
+            for tool in tools:
+                outcome = self._skip(tool, outcomes) or self._probe(tool)
+                outcomes[tool.name] = outcome
+                yield tool, outcome
+            return
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        positions = {tool.name: i for i, tool in enumerate(tools)}
+        pending = list(tools)
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for tool in list(pending):
+                    if self._is_cancelled(positions[tool.name]):
+                        pending.remove(tool)
+                        outcomes[tool.name] = (None, [], None)
+                        continue
+                    deps = self._dependencies(tool)
+                    if not all(d.name in outcomes for d in deps):
+                        continue
+                    pending.remove(tool)
+                    outcome = self._skip(tool, outcomes)
+                    if outcome is not None:
+                        outcomes[tool.name] = outcome
+                    else:
+                        position = positions[tool.name]
+                        running[pool.submit(self._probe, tool, position)] = tool
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        outcome = future.result()
+                        name = running.pop(future).name
+                        outcomes[name] = outcome
+                        # A failure cancels the tools after it,
+                        # configure is going to fail anyway.  The ones
+                        # before it may still fail first, as they would
+                        # in the sequential path.
+                        if outcome[0] is False:
+                            self._cancel(positions[name])
+        # Report in the same order as the sequential path.
+        for tool in tools:
+            yield tool, outcomes[tool.name]
+
+    def _cache_key(self, tool, entry):
+        """
+        Compute the fingerprint under which the probe result in 'entry'
+        is valid.  It covers the resolved executable, the environment
+        variables of the tool and the --with-* arguments.  For failed
+        probes, the $PATH directories are fingerprinted as well, since
+        installing the tool changes their mtime.
+        """
+        path = os.environ.get("PATH", os.defpath)
+        key = {
+            "args": {
+                k: v
+                for k, v in vars(self.args).items()
+                if k.startswith("with_")
+            },
+            "env": {var: os.environ.get(var) for var in tool.cache_env},
+            "path": path,
+            "tool": tool.fingerprint(self),
+        }
+        if not tool.fingerprint_executable:
+            return key
+        if entry["result"] is not None:
+            exe = which(entry["result"][0])
+            key["executable"] = exe and _file_fingerprint(exe)
+        else:
+            key["dirs"] = [
+                _file_fingerprint(d or os.curdir)
+                for d in path.split(os.pathsep)
+            ]
+        return key
+
+    def _cache_store(self, tool, ok, messages):
+        entry = {
+            "ok": ok,
+            "messages": messages,
+            "result": self.tool_results.get(tool.name) if ok else None,
+            "variables": self.tool_variables.get(tool.name, []),
+            "version_error": self._local.version_error,
+        }
+        entry["key"] = self._cache_key(tool, entry)
+        self._cache[tool.name] = entry
+
+    def _load_cache(self):
+        import json
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cache.get("cacheversion") == _cacheversion:
+            self._cache = cache["tools"]
+
+    def _save_cache(self):
+        if self.cache_file is None:
+            return
+        import json
+        cache = {"cacheversion": _cacheversion, "tools": self._cache}
+        write_if_changed(
+            self.cache_file, json.dumps(cache, indent=2, sort_keys=True) + "\n"
+        )
+
+    def _snapshot_key(self):
+        """
+        Compute the fingerprint of the environment a probe snapshot is
+        valid for: the contents of $PATH, the environment variables of
+        all tools and the --with-* arguments.  The fingerprint of each
+        tool is checked when its entry is used, as some depend on the
+        results of other tools.
+        """
+        env = {
+            var: os.environ.get(var)
+            for tool in self.tools
+            for var in tool.cache_env
+        }
+        args = {
+            k: v
+            for k, v in vars(self.args).items()
+            if k.startswith("with_")
+        }
+        return {"path": path_index.fingerprint(), "env": env, "args": args}
+
+    def _load_snapshot(self, filename):
+        import json
+        try:
+            with open(filename) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            self._output(f"cannot load probe snapshot {filename}: {e}")
+            return
+        if (
+            snapshot.get("cacheversion") != _cacheversion
+            or snapshot.get("key") != self._snapshot_key()
+        ):
+            self._output(
+                f"probe snapshot {filename} does not match, probing tools"
+            )
+            return
+        self._output(f"using probe snapshot {filename}")
+        self._snapshot = snapshot["tools"]
+
+    def _save_snapshot(self):
+        if self.args.save_probes is None:
+            return
+        filename = os.path.join(self.directory, self.args.save_probes)
+        import json
+        snapshot = {
+            "cacheversion": _cacheversion,
+            "key": self._snapshot_key(),
+            "tools": self._outcomes,
+        }
+        text = json.dumps(snapshot, indent=2, sort_keys=True) + "\n"
+        write_if_changed(filename, text)
+
+    def _write_trace(self):
+        if self.trace is None:
+            return
+        import json
+        total = time.monotonic() - self._trace_start
+        trace = {
+            "total": total,
+            "memo_hits": self.memo_hits,
+            "tools": self.trace,
+        }
+        write_if_changed(self.trace_file, json.dumps(trace, indent=2) + "\n")
+        self._output(f"writing {self.trace_file}")
+        self._output(f"{'tool':<16} {'wall':>9} {'child cpu':>9} {'spawns':>6}")
+        for record in sorted(self.trace, key=lambda r: -r["wall"]):
+            self._output(
+                f"{record['tool']:<16} {record['wall']:>8.3f}s "
+                f"{record['child_cpu']:>8.3f}s {record['spawns']:>6}"
+            )
+        self._output(f"{'total':<16} {total:>8.3f}s")
+
+    def _fail(self, error):
+        try:
+            self._save_cache()
+            self._save_snapshot()
+            self._write_trace()
+        except OSError as e:
+            # Not worth hiding the error of the tool.
+            self._output(f"Warning: {e}")
+        raise error
+
     def enable_prefix(self):
         """If enabled, process the --prefix argument."""
         self.prefix_enabled = True
 
     def enable_variant(self):
-        """If enable, process the --variant argument."""
+        """
+        If enable, process the --variant argument.  It may be given
+        several times, together with one --prefix per variant, to
+        write one config.mk per variant directory from a single run.
+        """
         self.variant_enabled = True
 
     def enable_configmk(self):
         """If enabled, output the config.mk makefile fragment."""
         self.configmk_enabled = True
 
-    def run(self):
-        parser = argparse.ArgumentParser()
+    def enable_configjson(self):
+        """If enabled, output the configure results as config.json."""
+        self.configjson_enabled = True
+
+    def enable_configpy(self):
+        """
+        If enabled, output the configure results as the Python module
+        configresult.py, which build scripts can simply import.
+        """
+        self.configpy_enabled = True
+
+    def _parse_variants(self, parser, args):
+        variants = getattr(args, "variant", None) or [""]
+        prefixes = getattr(args, "prefix", None) or ["/usr/local"]
+        if len(variants) == 1:
+            # Without several variants, the last --prefix wins, as it
+            # always did.
+            prefixes = prefixes[-1:]
+        elif len(prefixes) == 1:
+            prefixes = prefixes * len(variants)
+        elif len(prefixes) != len(variants):
+            parser.error(
+                f"got {len(prefixes)} --prefix arguments "
+                f"for {len(variants)} variants"
+            )
+        self.variants = list(zip(variants, prefixes))
+        # Keep args.prefix and args.variant as plain strings for
+        # configure scripts that look at them.
+        if self.prefix_enabled:
+            args.prefix = prefixes[0]
+        if self.variant_enabled:
+            args.variant = variants[0]
+
+    def _results(self, variant, prefix):
+        results = {}
+        if self.prefix_enabled:
+            results["prefix"] = prefix
+        if self.variant_enabled:
+            results["variant"] = variant
+        results["tools"] = {
+            tool.name: dict(
+                zip(("path", "version"), self.tool_results[tool.name])
+            )
+            for tool in self.tools
+        }
+        results["variables"] = dict(self._make_variables())
+        return results
+
+    def _make_variables(self):
+        variables = list(self.make_variables)
+        for tool in self.tools:
+            variables.extend(self.tool_variables.get(tool.name, []))
+        return variables
+
+    def _write_output(self, filename, content):
+        if write_if_changed(filename, content):
+            self._output(f"writing {filename}")
+        else:
+            self._output(f"{filename} is unchanged")
+
+    def _write_configjson(self, filename, variant, prefix):
+        import json
+        results = self._results(variant, prefix)
+        self._write_output(filename, json.dumps(results, indent=2) + "\n")
+
+    def _write_configpy(self, filename, variant, prefix):
+        lines = ["# this module is autogenerated by configure.py"]
+        for key, value in self._results(variant, prefix).items():
+            lines.append(f"{key} = {value!r}")
+        self._write_output(filename, "\n".join(lines) + "\n")
+
+    def _write_outputs(self, dirname, variant, prefix):
+        if self.configmk_enabled:
+            filename = os.path.join(dirname, "config.mk")
+            self._write_configmk(filename, variant, prefix)
+        if self.configjson_enabled:
+            filename = os.path.join(dirname, "config.json")
+            self._write_configjson(filename, variant, prefix)
+        if self.configpy_enabled:
+            filename = os.path.join(dirname, "configresult.py")
+            self._write_configpy(filename, variant, prefix)
+
+    def _substitutions(self, variant, prefix):
+        values = {}
+        if self.prefix_enabled:
+            values["prefix"] = prefix
+        if self.variant_enabled:
+            values["variant"] = variant
+        for tool in self.tools:
+            path, version = self.tool_results[tool.name]
+            values[tool.name] = path
+        for key, value in self._make_variables():
+            values[key] = value
+        return {key: str(value) for key, value in values.items()}
+
+    def _write_config_files(self, outputs):
+        """
+        Substitute all config files for each (dirname, variant, prefix)
+        in 'outputs'.  The templates are processed concurrently, and
+        only outputs whose content changed are rewritten.
+        """
+        if not self.config_files:
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = []
+        for dirname, variant, prefix in outputs:
+            values = self._substitutions(variant, prefix)
+            for template, output in self.config_files:
+                template = os.path.join(self.directory, template)
+                filename = os.path.join(dirname, output)
+                jobs.append((template, filename, values))
+        workers = min(len(jobs), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                changed = list(
+                    pool.map(lambda job: substitute_file(*job), jobs)
+                )
+            except OSError as e:
+                msg = f"Error: cannot generate config file: {e}"
+                self._output(msg)
+                raise ConfigureError(str(e), [msg])
+        for (template, filename, values), written in zip(jobs, changed):
+            if written:
+                self._output(f"writing {filename}")
+            else:
+                self._output(f"{filename} is unchanged")
+
+    def _inventory_file(self):
+        return os.path.abspath(os.path.join(self.directory, "inventory.mk"))
+
+    def _write_inventory(self):
+        if not self.inventories:
+            return
+        spec = {
+            "root": os.path.abspath(self.directory or os.curdir),
+            "inventories": self.inventories,
+            "python": sys.executable,
+            "pythonpath": os.path.dirname(os.path.abspath(__file__)),
+        }
+        filename = os.path.join(self.directory, "inventory.mk")
+        self._write_output(filename, inventory(self._inventory_file(), spec))
+
+    def _write_configmk(self, filename, variant, prefix):
+        lines = ["# this makefile fragment is autogenerated by configure.py"]
+        if self.prefix_enabled:
+            lines.append(f"prefix = {prefix}")
+        if self.variant_enabled:
+            lines.append(f"variant = {variant}")
+        for tool in self.tools:
+            path, version = self.tool_results[tool.name]
+            lines.append(f"{tool.name} = {path}")
+        for key, value in self._make_variables():
+            lines.append(f"{key} = {value}")
+        if self.inventories:
+            lines.append(f"include {self._inventory_file()}")
+        self._write_output(filename, "\n".join(lines) + "\n")
+
+    def _make_parser(self):
+        import argparse
+
+        class ArgumentParser(argparse.ArgumentParser):
+            def error(self, message):
+                raise UsageError(message)
+
+            def exit(self, status=0, message=None):
+                if message:
+                    sys.stderr.write(message)
+                raise ConfigureExit(status)
+
+        parser = self._parser = ArgumentParser()
         if self.prefix_enabled:
             parser.add_argument(
                 "--prefix",
                 type=str,
-                default="/usr/local",
+                action="append",
                 help="Directory prefix for installation",
             )
         if self.variant_enabled:
             parser.add_argument(
                 "--variant",
                 type=str,
-                default="",
+                action="append",
                 help="Directory for installation",
             )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            nargs="?",
+            const=os.cpu_count(),
+            default=1,
+            help="Number of tool checks to run in parallel",
+        )
+        parser.add_argument(
+            "-C",
+            "--config-cache",
+            dest="cache_file",
+            action="store_const",
+            const="config.cache",
+            help="Cache tool checks in config.cache",
+        )
+        parser.add_argument(
+            "--cache-file",
+            type=str,
+            dest="cache_file",
+            help="Cache tool checks in the given file",
+        )
+        parser.add_argument(
+            "--save-probes",
+            type=str,
+            metavar="FILE",
+            help="Save the results of all tool checks as a snapshot",
+        )
+        parser.add_argument(
+            "--load-probes",
+            type=str,
+            metavar="FILE",
+            help="Use the tool checks from a snapshot made by --save-probes, "
+            "if the contents of $PATH match",
+        )
+        parser.add_argument(
+            "--probe-timeout",
+            type=float,
+            default=60,
+            metavar="SECONDS",
+            help="Time after which the probes of a tool check are killed",
+        )
+        parser.add_argument(
+            "--configure-timeout",
+            type=float,
+            metavar="SECONDS",
+            help="Time after which all tool checks are killed",
+        )
+        parser.add_argument(
+            "--probe-daemon",
+            type=str,
+            metavar="SOCKET",
+            default=os.environ.get("BUILDCONFIG_DAEMON") or None,
+            help="Share the PATH index and probe results with other configure "
+            "runs through the probe daemon listening on SOCKET "
+            "(see 'python3 -m talerbuildconfig daemon')",
+        )
+        trace_env = os.environ.get("BUILDCONFIG_TRACE") or None
+        if trace_env is not None:
+            if trace_env.lower() in ("0", "no", "false", "off"):
+                trace_env = None
+            elif trace_env.lower() in ("1", "yes", "true", "on"):
+                trace_env = "config.trace.json"
+        parser.add_argument(
+            "--trace",
+            type=str,
+            nargs="?",
+            const="config.trace.json",
+            default=trace_env,
+            help="Record the cost of each tool check in a JSON file "
+            "(implies --jobs=1, so child CPU time can be attributed)",
+        )
         for tool in self.tools:
             tool.args(parser)
-        args = self.args = parser.parse_args()
+        return parser
 
-        for tool in self.tools:
-            res = tool.check(self)
-            if not res:
-                print(f"Error: tool '{tool.name}' not available")
-                if hasattr(tool, "hint"):
-                    print(f"Hint: {tool.hint}")
-                sys.exit(1)
-            if hasattr(tool, "version_spec"):
-                sv = semver.SimpleSpec(tool.version_spec)
-                path, version = self.tool_results[tool.name]
-                if not sv.match(semver.Version(version)):
-                    print(f"Error: Tool '{tool.name}' has version '{version}', but we require '{tool.version_spec}'")
-                    sys.exit(1)
+    def run(self):
+        """
+        Configure with the arguments from the command line, and exit
+        if that fails.
+        """
+        try:
+            self.configure()
+        except UsageError as e:
+            self._parser.print_usage(sys.stderr)
+            print(f"{self._parser.prog}: error: {e}", file=sys.stderr)
+            sys.exit(2)
+        except ConfigureExit as e:
+            sys.exit(e.status)
+        except ConfigureError:
+            sys.exit(1)
+
+    def configure(self, argv=None, directory="", output=print):
+        """
+        Configure with the arguments 'argv' (by default, those from
+        the command line), writing the outputs into 'directory' and
+        passing each line of progress output to 'output'.  Returns a
+        ConfigureResult, or raises a ConfigureError.  Options like
+        --help print to stdout and raise ConfigureExit.
+
+        The same BuildConfig can configure again; each call starts
+        from scratch, apart from a probe_state shared with others.
+        """
+        self._reset()
+        self.directory = directory
+        self._user_output = output
+        self._output = output = self._log_output
+        command = " ".join(sys.argv if argv is None else argv)
+        self._log_write(f"## configure {command}\n")
+        self._log_write(f"## PATH={os.environ.get('PATH', os.defpath)}\n")
+        try:
+            return self._configure(argv)
+        finally:
+            if self.probe_client is not None:
+                self.probe_client.close()
+                self.probe_client = None
+            self._write_log()
 
+    def _configure(self, argv):
+        directory = self.directory
+        output = self._output
+        parser = self._make_parser()
+        args = self.args = parser.parse_args(argv)
+        self._check_requirements()
+        self._parse_variants(parser, args)
+        self.cache_file = args.cache_file
+        if self.cache_file is not None:
+            self.cache_file = os.path.join(directory, self.cache_file)
+            self._load_cache()
+        if args.load_probes is not None:
+            self._load_snapshot(os.path.join(directory, args.load_probes))
+        if args.configure_timeout is not None:
+            self._deadline = time.monotonic() + args.configure_timeout
+        if args.probe_daemon:
+            try:
+                self.probe_client = ProbeClient(args.probe_daemon)
+            except OSError as e:
+                output(
+                    f"Warning: not using probe daemon {args.probe_daemon}: {e}"
+                )
+        jobs = args.jobs
+        if args.trace is not None:
+            self.trace_file = os.path.join(directory, args.trace)
+            self.trace = []
+            self._trace_start = time.monotonic()
+            jobs = 1
+
+        for tool, (ok, messages, error) in self._probe_all(jobs):
+            for msg in messages:
+                output(msg)
+            if ok is None:
+                # Cancelled because of a failure that is reported
+                # when we get to it.
+                continue
+            if not ok:
+                self._fail(error)
+        if self.memo_hits:
+            output(f"saved {self.memo_hits} duplicate probes")
 
         for tool in self.tools:
             path, version = self.tool_results[tool.name]
             if version is None:
-                print(f"found {tool.name} as {path}")
+                output(f"found {tool.name} as {path}")
             else:
-                print(f"found {tool.name} as {path} (version {version})")
+                output(f"found {tool.name} as {path} (version {version})")
 
-        if self.configmk_enabled:
-            with open("config.mk", "w") as f:
-                print("writing config.mk")
-                f.write("# this makefile fragment is autogenerated by configure.py\n")
-                if self.prefix_enabled:
-                    f.write(f"prefix = {args.prefix}\n")
-                if self.variant_enabled:
-                    f.write(f"variant = {args.variant}\n")
-                for tool in self.tools:
-                    path, version = self.tool_results[tool.name]
-                    f.write(f"{tool.name} = {path}\n")
+        try:
+            self._save_cache()
+            self._save_snapshot()
+            if len(self.variants) == 1:
+                variant, prefix = self.variants[0]
+                outputs = [(directory, variant, prefix)]
+            else:
+                # Tools are probed once, but each variant gets its own
+                # outputs in the variant directory.
+                outputs = []
+                for variant, prefix in self.variants:
+                    dirname = os.path.join(directory, variant)
+                    os.makedirs(dirname, exist_ok=True)
+                    outputs.append((dirname, variant, prefix))
+            self._write_inventory()
+            for dirname, variant, prefix in outputs:
+                self._write_outputs(dirname, variant, prefix)
+            self._write_config_files(outputs)
+            self._write_trace()
+        except OSError as e:
+            msg = f"Error: cannot write configure output: {e}"
+            output(msg)
+            raise ConfigureError(str(e), [msg])
+        return ConfigureResult(self)
+
+
+def configure_projects(projects, jobs=None, output=print):
+    """
+    Configure several projects concurrently in this process, sharing
+    the PATH index and the probe results between them.  'projects' is
+    a list of (buildconfig, directory, argv) tuples.  The output of
+    each project is passed to 'output' as one block, in order.
+    Returns a list with the ConfigureResult, or the ConfigureError,
+    of each project.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    state = ProbeState()
+
+    def configure(project):
+        buildconfig, directory, argv = project
+        buildconfig.probe_state = state
+        buildconfig._shared_probe_state = True
+        lines = []
+        try:
+            result = buildconfig.configure(argv, directory, output=lines.append)
+        except ConfigureError as e:
+            result = e
+        return lines, result
+
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs or len(projects) or 1) as pool:
+        for (_, directory, _), (lines, result) in zip(
+            projects, pool.map(configure, projects)
+        ):
+            output(f"== {directory or os.curdir}")
+            for line in lines:
+                output(line)
+            results.append(result)
+    return results
+
+
+# The umask can only be read by setting it, which is not safe once
+# threads may be creating files, so it is read at import.
+_umask = os.umask(0o022)
+os.umask(_umask)
+
+
+def write_if_changed(filename, content):
+    """
+    Atomically replace 'filename' with 'content', via a temporary file
+    in the same directory.  If the file already has this content, it
+    is left alone, so its mtime does not trigger rebuilds.  Returns
+    True if the file was written.
+    """
+    try:
+        with open(filename) as f:
+            if f.read() == content:
+                return False
+    except (OSError, ValueError):
+        pass
+    import tempfile
+    dirname, basename = os.path.split(filename)
+    fd, tmp = tempfile.mkstemp(dir=dirname or os.curdir, prefix=f".{basename}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except OSError:
+            # As open() would create it.
+            mode = 0o666 & ~_umask
+        os.chmod(tmp, mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return True
+
+
+def substitute(text, values):
+    """
+    Replace each @name@ in 'text' with values[name].  Names without a
+    value are left alone.
+    """
+    import re
+    return re.sub(
+        r"@([A-Za-z_][A-Za-z0-9_]*)@",
+        lambda m: values.get(m.group(1), m.group(0)),
+        text,
+    )
+
+
+def substitute_file(template, filename, values):
+    """
+    Write 'filename' from the 'template' file with substitute(),
+    if its content changed.  Returns True if the file was written.
+    """
+    with open(template) as f:
+        text = f.read()
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    return write_if_changed(filename, substitute(text, values))
+
+
+def inventory(filename, spec):
+    """
+    Return the makefile fragment 'filename' for the file inventories
+    in 'spec' (see BuildConfig.add_inventory).  Its first lines record
+    'spec', and its rule runs "talerbuildconfig inventory" to write
+    it again when a directory in the listed trees changes.  The files
+    are listed below $(inventory_root), so that they resolve from any
+    directory make runs in.
+    """
+    import fnmatch
+    import json
+    import shlex
+    root = spec["root"]
+    lines = [
+        "# this makefile fragment is autogenerated by configure.py",
+        "# inventory: " + json.dumps(spec, sort_keys=True),
+        f"inventory_root = {root}",
+    ]
+    dirs = []
+    for name, directory, patterns, exclude in spec["inventories"]:
+        files = []
+        top = os.path.normpath(os.path.join(root, directory))
+        # A tree that does not exist yet is picked up once it is
+        # created, which changes the mtime of an existing parent.
+        parent = top
+        while not os.path.isdir(parent):
+            parent = os.path.dirname(parent)
+        if parent != top:
+            dirs.append(parent)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = sorted(d for d in dirnames if d not in exclude)
+            dirs.append(dirpath)
+            rel = os.path.relpath(dirpath, root)
+            for f in sorted(filenames):
+                if any(fnmatch.fnmatchcase(f, p) for p in patterns):
+                    path = os.path.normpath(os.path.join(rel, f))
+                    files.append(f"$(inventory_root)/{path}")
+        lines.append(" \\\n    ".join([f"{name} ="] + files))
+    # The rule must not become the default goal of the including
+    # Makefile.
+    lines.append("inventory_default_goal := $(.DEFAULT_GOAL)")
+    dirs = sorted(set(dirs))
+    lines.append(" \\\n    ".join([f"{filename}:"] + dirs))
+    command = [spec["python"], "-m", "talerbuildconfig", "inventory", filename]
+    lines.append(
+        f"\tcd {shlex.quote(root)} && "
+        f"PYTHONPATH={shlex.quote(spec['pythonpath'])} "
+        + " ".join(shlex.quote(arg) for arg in command)
+    )
+    # Removed directories must not stop make.
+    lines.append(" \\\n    ".join(dirs) + ":")
+    lines.append(".DEFAULT_GOAL := $(inventory_default_goal)")
+    return "\n".join(lines) + "\n"
+
+
+def update_inventory(filename):
+    """
+    Write the inventory.mk 'filename' again, with the spec recorded in
+    it.  Its mtime is updated even if the lists did not change, so that
+    make does not run the update again until a directory changes.
+    """
+    import json
+    with open(filename) as f:
+        f.readline()
+        spec = json.loads(f.readline().partition(": ")[2])
+    if not write_if_changed(filename, inventory(filename, spec)):
+        os.utime(filename)
+
+
+class PathIndex:
+    """
+    Index of the executables found in $PATH.
+
+    Each directory in $PATH is listed only once, no matter how many
+    names are looked up.  The index is rebuilt when $PATH changes.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        # The $PATH to index, if not the one of the environment
+        self._pinned = path
+        self._path = None
+        self._entries = {}
+        self._found = {}
+        self._fingerprint = None
+
+    def _refresh(self):
+        path = self._pinned or os.environ.get("PATH", os.defpath)
+        if path != self._path:
+            self._scan(path)
+
+    def _scan(self, path):
+        entries = {}
+        for d in path.split(os.pathsep):
+            # An empty $PATH component means the current directory.
+            d = d or os.curdir
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        entries.setdefault(entry.name, []).append(entry)
+            except OSError:
+                continue
+        self._path = path
+        self._entries = entries
+        self._found = {}
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """
+        Return a hash over the names, sizes and mtimes of everything in
+        the $PATH directories, which identifies the installed tools.
+        """
+        import hashlib
+        with self._lock:
+            self._refresh()
+            if self._fingerprint is not None:
+                return self._fingerprint
+            h = hashlib.sha256(self._path.encode("utf-8", "surrogateescape"))
+            for name in sorted(self._entries):
+                for entry in self._entries[name]:
+                    # Follow symlinks, so that re-pointing one (as
+                    # update-alternatives does) changes the hash.
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                    line = f"\0{entry.path}\0{st.st_size}\0{st.st_mtime_ns}"
+                    h.update(line.encode("utf-8", "surrogateescape"))
+            self._fingerprint = h.hexdigest()
+            return self._fingerprint
+
+    def which(self, name):
+        """Return the path of the executable 'name', or None."""
+        if os.sep in name:
+            if os.path.isfile(name) and os.access(name, os.X_OK):
+                return name
+            return None
+        with self._lock:
+            self._refresh()
+            if name in self._found:
+                return self._found[name]
+            found = None
+            for entry in self._entries.get(name, ()):
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        found = entry.path
+                        break
+                except OSError:
+                    continue
+            self._found[name] = found
+            return found
+
+
+path_index = PathIndex()
+
+
+def which(name):
+    return path_index.which(name)
 
 
 def existence(name):
-    return find_executable(name) is not None
+    return which(name) is not None
+
+
+def _file_fingerprint(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, st.st_ino, st.st_size, st.st_mtime_ns]
 
 
 class YarnTool(Tool):
     name = "yarn"
     description = "The yarn package manager for node"
+    depends = ("node",)
 
     def args(self, parser):
         parser.add_argument("--with-yarn", action="store")
@@ -168,12 +1521,9 @@ class YarnTool(Tool):
         if yarn_arg is not None:
             buildconfig._set_tool("yarn", yarn_arg)
             return True
-        if existence("yarn"):
-            p1 = subprocess.run(
-                ["yarn", "help"], stderr=subprocess.STDOUT, stdout=subprocess.PIPE
-            )
-            if "No such file or directory" in p1.stdout.decode("utf-8"):
-                if existence("cmdtest"):
+        if buildconfig.existence("yarn"):
+            if is_cmdtest_yarn(buildconfig.which("yarn")):
+                if buildconfig.existence("cmdtest"):
                     buildconfig._warn(
                         "cmdtest is installed, this can lead to known issues with yarn."
                     )
@@ -182,33 +1532,602 @@ class YarnTool(Tool):
                     "Please remove the conflicting binary before proceeding"
                 )
                 return False
-            yarn_version = tool_version("yarn --version")
-            buildconfig._set_tool("yarn", "yarn", yarn_version)
+            facts = buildconfig.query(
+                Probe(["yarn", "--version"], version=parse_version)
+            )
+            buildconfig._set_tool("yarn", "yarn", facts["version"])
             return True
-        elif existence("yarnpkg"):
-            yarn_version = tool_version("yarnpkg --version")
-            buildconfig._set_tool("yarn", "yarnpkg", yarn_version)
+        elif buildconfig.existence("yarnpkg"):
+            facts = buildconfig.query(
+                Probe(["yarnpkg", "--version"], version=parse_version)
+            )
+            buildconfig._set_tool("yarn", "yarnpkg", facts["version"])
             return True
         return False
 
 
-def tool_version(name):
-    return subprocess.getstatusoutput(name)[1]
+class ProbeResult:
+    __slots__ = ["argv", "returncode", "stdout", "stderr"]
+
+    def __init__(self, argv, returncode, stdout, stderr):
+        self.argv = argv
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __repr__(self):
+        return "ProbeResult(argv=%r, returncode=%r)" % (
+            self.argv, self.returncode
+        )
+
+    def output(self):
+        """Return the stripped output, preferring stdout over stderr."""
+        return (self.stdout or self.stderr).strip()
+
+
+class ProbeTimeout(Exception):
+    """A probe command did not finish before its deadline."""
+
+    def __init__(self, argv, timeout):
+        self.argv = argv
+        self.timeout = timeout
+        super().__init__(
+            f"'{' '.join(argv)}' did not finish within {timeout:.1f}s"
+        )
+
+
+class ProbeCancelled(Exception):
+    """A probe command was killed because configure already failed."""
+
+
+# Per-thread probe state of the tool check running in this thread:
+# 'trace' is its trace record if tracing is enabled, 'deadline' the
+# time.monotonic() by which its probes must finish, and 'owner' the
+# BuildConfig that may cancel them.
+_probe_local = threading.local()
+
+
+def _kill_group(pid):
+    import signal
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _start_probe(argv, trace=None, deadline=None, owner=None):
+    """
+    Start the probe command 'argv', returning its Popen, or its
+    ProbeResult if it cannot be run at all.
+    """
+    import subprocess
+    if deadline is not None and deadline <= time.monotonic():
+        raise ProbeTimeout(argv, 0)
+    if owner is not None and owner._is_cancelled():
+        raise ProbeCancelled(argv)
+    start = time.monotonic()
+    try:
+        # Each probe gets its own process group, so that a probe that
+        # hangs can be killed together with its children.
+        proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+    except OSError as e:
+        if owner is not None:
+            owner._log_probe(argv, f"cannot run: {e}", start)
+        return ProbeResult(argv, 127, "", str(e))
+    proc.start = start
+    if trace is not None:
+        trace["spawns"] += 1
+    if owner is not None:
+        owner._probe_started(proc.pid)
+    return proc
+
+
+def _finish_probe(proc, deadline=None, owner=None):
+    """Wait for the probe 'proc' and return its ProbeResult."""
+    import subprocess
+    argv = proc.args
+    timeout = None
+    if deadline is not None:
+        timeout = max(deadline - time.monotonic(), 0)
+    try:
+        try:
+            out, err = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            elapsed = deadline - proc.start
+            if owner is not None:
+                owner._log_probe(
+                    argv, f"killed after {elapsed:.1f}s", proc.start
+                )
+            raise ProbeTimeout(argv, elapsed)
+    finally:
+        _stop_probe(proc, owner)
+    if owner is not None and owner._is_cancelled():
+        raise ProbeCancelled(argv)
+    result = ProbeResult(
+        argv,
+        proc.returncode,
+        out.decode("utf-8", "replace"),
+        err.decode("utf-8", "replace"),
+    )
+    if owner is not None:
+        owner._log_probe(
+            argv, f"exit status {proc.returncode}", proc.start, result
+        )
+    return result
+
+
+def _stop_probe(proc, owner=None):
+    if proc.returncode is None:
+        # Not reaped yet, so the process group is still ours.
+        _kill_group(proc.pid)
+        proc.communicate()
+    if owner is not None:
+        owner._probe_finished(proc.pid)
+
+
+def run_probes(argvs):
+    """
+    Run several probe commands concurrently, without a shell, and
+    return a ProbeResult for each of them.  Raises ProbeTimeout if
+    the deadline of the current tool check passes.
+
+    The commands are started at once and then waited for in the
+    calling thread, so this works in any thread.
+    """
+    trace = getattr(_probe_local, "trace", None)
+    deadline = getattr(_probe_local, "deadline", None)
+    owner = getattr(_probe_local, "owner", None)
+    procs = []
+    try:
+        for argv in argvs:
+            procs.append(_start_probe(list(argv), trace, deadline, owner))
+        results = []
+        for i, proc in enumerate(procs):
+            if not isinstance(proc, ProbeResult):
+                procs[i] = proc = _finish_probe(proc, deadline, owner)
+            results.append(proc)
+        return results
+    finally:
+        for proc in procs:
+            if not isinstance(proc, ProbeResult):
+                _stop_probe(proc, owner)
+
+
+def run_probe(argv):
+    return run_probes([argv])[0]
+
+
+class Probe:
+    """
+    A single run of a command, together with parsers that each extract
+    one fact (existence, version, capabilities, ...) from its
+    ProbeResult.  Run it with BuildConfig.query.
+    """
+
+    def __init__(self, argv, **parsers):
+        self.argv = list(argv)
+        self.parsers = parsers
+
+    def facts(self, result):
+        return {name: parse(result) for name, parse in self.parsers.items()}
+
+
+def parse_version(result):
+    """Return the first version number in the output, or None."""
+    import re
+    m = re.search(r"[0-9]+(\.[0-9]+)+", result.output())
+    return m.group(0) if m else None
+
+
+def is_cmdtest_yarn(path):
+    """
+    Return True if the executable 'path' is the yarn of cmdtest.  It is
+    a Python script, while the package manager runs on node or sh, so
+    this needs no spawn.
+    """
+    interpreter = path and _shebang_interpreter(path)
+    if interpreter is None:
+        return False
+    return os.path.basename(interpreter).startswith("python")
+
+
+def tool_version(argv):
+    if isinstance(argv, str):
+        import shlex
+        argv = shlex.split(argv)
+    return run_probe(argv).output()
+
+
+# Finds the installed distributions among 'names' by looking at the
+# dist-info and egg-info directories on 'path', without importing
+# anything.  This is run in the configure interpreter as well as,
+# with -c, in the interpreter of a found Python script.
+_DIST_VERSIONS = """
+import json, os, sys
+def dist_versions(names, path):
+    def norm(name):
+        return name.lower().replace("-", "_").replace(".", "_")
+    wanted = {norm(n): n for n in names}
+    found = {}
+    for d in path:
+        try:
+            entries = os.listdir(d or os.curdir)
+        except OSError:
+            continue
+        for e in entries:
+            base, ext = os.path.splitext(e)
+            if ext not in (".dist-info", ".egg-info"):
+                continue
+            dist, _, version = base.partition("-")
+            version = version.split("-")[0]
+            name = wanted.get(norm(dist))
+            if name is not None and version and name not in found:
+                found[name] = version
+    return found
+"""
+
+
+def _shebang_interpreter(path):
+    """Return the interpreter named in the #! line of 'path', or None."""
+    try:
+        with open(path, "rb") as f:
+            line = f.readline(256)
+    except OSError:
+        return None
+    if not line.startswith(b"#!"):
+        return None
+    words = line[2:].decode("utf-8", "replace").split()
+    if len(words) > 1 and os.path.basename(words[0]) == "env":
+        words = words[1:]
+    return words[0] if words else None
+
+
+def local_dist_versions(names):
+    ns = {}
+    exec(_DIST_VERSIONS, ns)
+    return ns["dist_versions"](names, sys.path)
+
+
+def dist_versions(executable, names):
+    """
+    Return the versions of the Python distributions 'names' that are
+    installed for the interpreter running the script 'executable'.
+    Distributions that are not installed are missing from the result.
+    """
+    path = which(executable)
+    interpreter = path and _shebang_interpreter(path)
+    if interpreter is None:
+        return local_dist_versions(names)
+    if not os.path.basename(interpreter).startswith("python"):
+        return local_dist_versions(names)
+    import json
+    script = _DIST_VERSIONS + (
+        "print(json.dumps(dist_versions(sys.argv[1:], sys.path)))"
+    )
+    p = run_probe([interpreter, "-c", script] + list(names))
+    try:
+        return json.loads(p.stdout)
+    except ValueError:
+        return {}
+
+
+def dist_version(executable, name):
+    return dist_versions(executable, [name]).get(name)
+
+
+_PYTHON_INFO = _DIST_VERSIONS + """
+import sysconfig
+print(json.dumps({
+    "version": ".".join(str(n) for n in sys.version_info[:3]),
+    "version_info": list(sys.version_info[:3]),
+    "executable": sys.executable,
+    "path": sys.path,
+    "paths": sysconfig.get_paths(),
+    "dists": dist_versions(sys.argv[1:], sys.path),
+}))
+"""
+
+
+def _python_env():
+    # Environment variables that change the sys.path of a Python
+    return tuple(
+        os.environ.get(var) for var in (
+            "PYTHONPATH", "PYTHONHOME", "PYTHONUSERBASE", "PYTHONNOUSERSITE"
+        )
+    )
+
+
+def _site_dirs(info):
+    # The sys.path entries reported by python_info(), without "" (the
+    # current directory, whose mtime changes with every configure run)
+    return [d for d in (info or {}).get("path", []) if d]
+
+
+def python_info(interpreter, dists=()):
+    """
+    Run the Python 'interpreter' once, and return what it reports about
+    itself: its "version" string, its "version_info" as a list of
+    numbers, its "executable", its sys.path as "path", its sysconfig
+    "paths" and, in "dists", the versions of the Python distributions
+    'dists' that are installed for it.  Returns None if it is not a
+    working Python.
+    """
+    import json
+    p = run_probe([interpreter, "-c", _PYTHON_INFO] + list(dists))
+    try:
+        return json.loads(p.stdout)
+    except ValueError:
+        return None
+
+
+def _encode_value(value):
+    if isinstance(value, ProbeResult):
+        return {
+            "probe": [value.argv, value.returncode, value.stdout, value.stderr]
+        }
+    return {"value": value}
+
+
+def _decode_value(data):
+    if "probe" in data:
+        return ProbeResult(*data["probe"])
+    return data["value"]
+
+
+class ProbeClient:
+    """
+    Client of a probe daemon (see serve_probes), which shares its
+    PATH index and probe results between the configure runs on a
+    host.  Each thread talks to the daemon over its own connection.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        # Fail early if nobody is listening.
+        self._request({"op": "hello"})
+
+    def _connect(self):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        conn = self._local.conn = (sock, sock.makefile("rb"))
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _disconnect(self):
+        # The daemon releases the keys this connection was computing.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+            conn[1].close()
+            conn[0].close()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for sock, rfile in connections:
+            rfile.close()
+            sock.close()
+
+    def _request(self, request):
+        import json
+        import socket
+        sock, rfile = getattr(self._local, "conn", None) or self._connect()
+        # Waiting for another configure run that computes the same
+        # result counts against the deadline of the current check.
+        deadline = getattr(_probe_local, "deadline", None)
+        timeout = None
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0.001)
+        sock.settimeout(timeout)
+        try:
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            line = rfile.readline()
+        except socket.timeout:
+            self._disconnect()
+            raise ProbeTimeout([f"probe daemon {self.socket_path}"], timeout)
+        except OSError:
+            self._disconnect()
+            raise
+        if not line:
+            self._disconnect()
+            raise OSError(
+                f"probe daemon {self.socket_path} closed the connection"
+            )
+        return json.loads(line)
+
+    def which(self, name):
+        # Relative $PATH entries are resolved here, as the daemon runs
+        # in a different directory.
+        path = os.pathsep.join(
+            os.path.abspath(d or os.curdir)
+            for d in os.environ.get("PATH", os.defpath).split(os.pathsep)
+        )
+        reply = self._request({"op": "which", "path": path, "name": name})
+        return reply["value"]
+
+    def memoize(self, key, fn, files=()):
+        """
+        Return the result of fn() for 'key' from the daemon.  If it has
+        none, compute it while other clients asking for it wait, and
+        hand it to the daemon, valid until one of 'files' changes.
+        """
+        import json
+        key = json.dumps(key)
+        reply = self._request({"op": "get", "key": key})
+        if reply["hit"]:
+            owner = getattr(_probe_local, "owner", None)
+            if owner is not None:
+                owner._log_lines([f"{key} answered by the probe daemon"])
+            return _decode_value(reply["data"])
+        try:
+            value = fn()
+        except BaseException:
+            self._disconnect()
+            raise
+        if callable(files):
+            files = files(value)
+        files = [os.path.abspath(f) for f in files]
+        self._request({
+            "op": "put",
+            "key": key,
+            "data": _encode_value(value),
+            "files": files,
+        })
+        return value
+
+
+def serve_probes(socket_path):
+    """
+    Run a probe daemon on the Unix socket 'socket_path' until it is
+    interrupted.  It keeps the PATH indexes and probe results of the
+    configure runs using it (see --probe-daemon), so that concurrent
+    configure runs on a host probe each tool only once.  A result is
+    dropped when one of the executables it depends on changes, and a
+    PATH index is rebuilt when one of its directories changes.
+    """
+    import json
+    import socketserver
+
+    class ProbeDaemon(
+        socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+    ):
+        daemon_threads = True
+
+        def __init__(self):
+            super().__init__(socket_path, Handler)
+            self.cond = threading.Condition()
+            # key -> (data, files, file fingerprints)
+            self.results = {}
+            # keys being computed -> Handler computing them
+            self.pending = {}
+            # $PATH -> (PathIndex, directory fingerprints)
+            self.indexes = {}
+
+        def which(self, path, name):
+            dirs = [_file_fingerprint(d) for d in path.split(os.pathsep)]
+            with self.cond:
+                index, stamp = self.indexes.get(path, (None, None))
+                if stamp != dirs:
+                    index = PathIndex(path)
+                    self.indexes[path] = (index, dirs)
+            return index.which(name)
+
+        def get(self, key, handler):
+            with self.cond:
+                while key in self.pending:
+                    self.cond.wait()
+                entry = self.results.get(key)
+                if entry is not None:
+                    data, files, stamp = entry
+                    if [_file_fingerprint(f) for f in files] == stamp:
+                        return {"hit": True, "data": data}
+                    del self.results[key]
+                self.pending[key] = handler
+                return {"hit": False}
+
+        def put(self, key, data, files, handler):
+            stamp = [_file_fingerprint(f) for f in files]
+            with self.cond:
+                if self.pending.get(key) is handler:
+                    del self.pending[key]
+                self.results[key] = (data, files, stamp)
+                self.cond.notify_all()
+            return {}
 
+        def release(self, handler):
+            with self.cond:
+                for key in [k for k, h in self.pending.items() if h is handler]:
+                    del self.pending[key]
+                self.cond.notify_all()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            server = self.server
+            try:
+                for line in self.rfile:
+                    request = json.loads(line)
+                    op = request["op"]
+                    if op == "which":
+                        value = server.which(request["path"], request["name"])
+                        reply = {"value": value}
+                    elif op == "get":
+                        reply = server.get(request["key"], self)
+                    elif op == "put":
+                        reply = server.put(
+                            request["key"],
+                            request["data"],
+                            request["files"],
+                            self,
+                        )
+                    else:
+                        reply = {}
+                    self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            finally:
+                server.release(self)
+
+    if os.path.exists(socket_path):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            # Left over from a daemon that died.
+            os.unlink(socket_path)
+        else:
+            raise OSError(
+                f"a probe daemon is already listening on {socket_path}"
+            )
+        finally:
+            sock.close()
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with ProbeDaemon() as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+class EmscriptenTool(Tool):
+    name = "emcc"
+    # The first run of emcc populates its cache, which is slow.
+    timeout = 600
 
-class EmscriptenTool:
     def args(self, parser):
         pass
 
     def check(self, buildconfig):
-        if existence("emcc"):
-            emscripten_version = tool_version("emcc --version")
-            buildconfig._set_tool("emcc", "emcc", emscripten_version)
+        if buildconfig.existence("emcc"):
+            facts = buildconfig.query(
+                Probe(["emcc", "--version"], version=parse_version)
+            )
+            buildconfig._set_tool("emcc", "emcc", facts["version"])
             return True
         return False
 
 class PyToxTool(Tool):
     name ="tox"
+    depends = ("python",)
+    python_dists = ("tox",)
 
     def args(self, parser):
         parser.add_argument(
@@ -219,9 +2138,8 @@ class PyToxTool(Tool):
         # No suffix. Would probably be cheaper to do this in
         # the dict as well. We also need to check the python
         # version it was build against (TODO).
-        if existence("tox"):
-            import tox
-            mypytox_version = tox.__version__
+        if buildconfig.existence("tox"):
+            mypytox_version = buildconfig.dist_version("tox", "tox")
             buildconfig._set_tool("tox", "tox", mypytox_version)
             return True
         else:
@@ -242,17 +2160,16 @@ class PyToxTool(Tool):
                 "4.0": "tox-4.0",
             }
             for key, value in version_dict.items():
-                if existence(value):
-                    # FIXME: This version reporting is slightly off
-                    # FIXME: and only maps to the suffix.
-                    import tox
-                    mypytox_version = tox.__version__
+                if buildconfig.existence(value):
+                    mypytox_version = buildconfig.dist_version(value, "tox")
                     buildconfig._set_tool("tox", value, mypytox_version)
                     return True
 
 
 class YapfTool(Tool):
     name ="yapf"
+    depends = ("python",)
+    python_dists = ("yapf",)
 
     def args(self, parser):
         parser.add_argument(
@@ -263,9 +2180,8 @@ class YapfTool(Tool):
         # No suffix. Would probably be cheaper to do this in
         # the dict as well. We also need to check the python
         # version it was build against (TODO).
-        if existence("yapf"):
-            import yapf
-            myyapf_version = yapf.__version__
+        if buildconfig.existence("yapf"):
+            myyapf_version = buildconfig.dist_version("yapf", "yapf")
             buildconfig._set_tool("yapf", "yapf", myyapf_version)
             return True
         else:
@@ -297,17 +2213,16 @@ class YapfTool(Tool):
                 "5.1": "yapf-4.0",
             }
             for key, value in version_dict.items():
-                if existence(value):
-                    # FIXME: This version reporting is slightly off
-                    # FIXME: and only maps to the suffix.
-                    import yapf
-                    myyapf_version = yapf.__version__
+                if buildconfig.existence(value):
+                    myyapf_version = buildconfig.dist_version(value, "yapf")
                     buildconfig._set_tool("yapf", value, myyapf_version)
                     return True
 
 
 class PyBabelTool(Tool):
     name = "pybabel"
+    depends = ("python",)
+    python_dists = ("Babel",)
 
     def args(self, parser):
         parser.add_argument(
@@ -318,9 +2233,8 @@ class PyBabelTool(Tool):
         # No suffix. Would probably be cheaper to do this in
         # the dict as well. We also need to check the python
         # version it was build against (TODO).
-        if existence("pybabel"):
-            import babel
-            pybabel_version = babel.__version__
+        if buildconfig.existence("pybabel"):
+            pybabel_version = buildconfig.dist_version("pybabel", "Babel")
             buildconfig._set_tool("pybabel", "pybabel", pybabel_version)
             return True
         else:
@@ -345,10 +2259,8 @@ class PyBabelTool(Tool):
                 "4.0": "pybabel-4.0",
             }
             for key, value in version_dict.items():
-                if existence(value):
-                    # FIXME: This version reporting is slightly off
-                    # FIXME: and only maps to the suffix.
-                    pybabel_version = key
+                if buildconfig.existence(value):
+                    pybabel_version = buildconfig.dist_version(value, "Babel")
                     buildconfig._set_tool("pybabel", value, pybabel_version)
                     return True
 
@@ -364,39 +2276,33 @@ class PythonTool(Tool):
         )
 
     def check(self, buildconfig):
-        # No suffix. Would probably be cheaper to do this in
-        # the dict as well. We need at least version 3.7.
-        if existence("python") and (shlex.split(subprocess.getstatusoutput("python --version")[1])[1] >= '3.7'):
-            # python might not be python3. It might not even be
-            # python 3.x.
-            python_version = shlex.split(subprocess.getstatusoutput("python --version")[1])[1]
-            if python_version >= '3.7':
-                buildconfig._set_tool("python", "python", python_version)
+        # No suffix first, then the suffixed names.  We know the names
+        # in advance, so use a dictionary and iterate over it.  Use
+        # enough names to safe updating this for another couple of
+        # years.  We need at least version 3.7.
+        version_dict = {
+            "": "python",
+            "3.7": "python3.7",
+            "3.8": "python3.8",
+            "3.9": "python3.9",
+            "4.0": "python4.0",
+        }
+        for key, value in version_dict.items():
+            if not buildconfig.existence(value):
+                continue
+            # python might not be python3.  It might not even be
+            # python 3.x.  One probe tells us its exact version, and
+            # what the other Python tools need to know about it.
+            info = buildconfig.python_info(value)
+            if info is not None and tuple(info["version_info"][:2]) >= (3, 7):
+                buildconfig._set_tool("python", value, info["version"])
                 return True
-        else:
-            # Has suffix, try suffix. We know the names in advance,
-            # so use a dictionary and iterate over it. Use enough names
-            # to safe updating this for another couple of years.
-            #
-            # Food for thought: If we only accept python 3.7 or higher,
-            # is checking pybabel + pybabel-3.[0-9]* too much and could
-            # be broken down to pybabel + pybabel-3.7 and later names?
-            version_dict = {
-                "3.7": "python3.7",
-                "3.8": "python3.8",
-                "3.9": "python3.9",
-                "4.0": "python4.0",
-            }
-            for key, value in version_dict.items():
-                if existence(value):
-                    python3_version = key
-                    buildconfig._set_tool("python", value, python3_version)
-                    return True
 
 
 # TODO: Make this really optional, not use a hack ("true").
 class BrowserTool(Tool):
     name = "browser"
+    cache_env = ("BROWSER",)
 
     def args(self, parser):
         parser.add_argument(
@@ -416,7 +2322,7 @@ class BrowserTool(Tool):
             buildconfig._set_tool("browser", os.environ["BROWSER"])
             return True
         for value in browser_dict.values():
-            if existence(value):
+            if buildconfig.existence(value):
                 buildconfig._set_tool("browser", value)
                 return True
 
@@ -432,17 +2338,15 @@ class NodeJsTool(Tool):
         pass
 
     def check(self, buildconfig):
-        if existence("node") is None:
+        if not buildconfig.existence("node"):
             return False
-        if (
-            subprocess.getstatusoutput(
-                "node -p 'process.exit(!(/v([0-9]+)/.exec(process.version)[1] >= 4))'"
-            )[1]
-            != ""
-        ):
+        facts = buildconfig.query(
+            Probe(["node", "--version"], version=parse_version)
+        )
+        node_version = facts["version"]
+        if node_version is None or int(node_version.split(".")[0]) < 4:
             buildconfig._warn("your node version is too old, use Node 4.x or newer")
             return False
-        node_version = tool_version("node --version").lstrip("v")
         buildconfig._set_tool("node", "node", version=node_version)
         return True
 
@@ -455,8 +2359,335 @@ class PosixTool(Tool):
         pass
 
     def check(self, buildconfig):
-        found = existence("find")
+        found = buildconfig.existence(self.name)
         if found:
             buildconfig._set_tool(self.name, self.name)
             return True
         return False
+
+
+class CCompilerTool(Tool):
+    """The C compiler, from $CC, --with-cc or the usual names."""
+
+    name = "cc"
+    cache_env = ("CC",)
+
+    def args(self, parser):
+        parser.add_argument(
+            "--with-cc", type=str, help="name of the C compiler"
+        )
+
+    def check(self, buildconfig):
+        import shlex
+        candidates = [buildconfig.args.with_cc, os.environ.get("CC")]
+        for cc in candidates:
+            if cc:
+                break
+        else:
+            cc = None
+            for name in ("cc", "gcc", "clang"):
+                if buildconfig.existence(name):
+                    cc = name
+                    break
+        if cc is None or not buildconfig.existence(shlex.split(cc)[0]):
+            return False
+        facts = buildconfig.query(
+            Probe(shlex.split(cc) + ["--version"], version=parse_version)
+        )
+        buildconfig._set_tool("cc", cc, facts["version"])
+        return True
+
+
+class CompileCheck(Tool):
+    """
+    Base class of autoconf-style feature checks, which try to compile
+    (and, if 'link' is set, link) 'source' with the C compiler found
+    by CCompilerTool.  The result is "yes" or "no"; if the check is
+    required, "no" fails configure.
+
+    The outcome is cached by a hash of the source, the flags and the
+    compiler's fingerprint.  Only "yes" is kept in config.cache and
+    probe snapshots, since installing a missing header or library
+    changes nothing in that hash.  CCompilerTool must be added.  The
+    checks run one after another by default; run configure with --jobs
+    to run many of them at once.
+    """
+
+    depends = ("cc",)
+    cache_env = ("CPPFLAGS", "CFLAGS", "LDFLAGS")
+    # The result is "yes" or "no", not an executable.
+    fingerprint_executable = False
+    source = "int main(void) { return 0; }\n"
+    flags = ()
+    link = False
+
+    def __init__(self, name, required=False):
+        self.name = name
+        self.required = required
+
+    def args(self, parser):
+        pass
+
+    def _command(self, buildconfig, tmp=""):
+        import shlex
+        src = os.path.join(tmp, "conftest.c")
+        out = os.path.join(tmp, "conftest")
+        if "cc" not in buildconfig.tool_results:
+            raise ConfigureError(
+                f"CompileCheck {self.name} requires CCompilerTool"
+            )
+        cc = shlex.split(buildconfig.tool_results["cc"][0])
+        cmd = cc + shlex.split(os.environ.get("CPPFLAGS", ""))
+        cmd += shlex.split(os.environ.get("CFLAGS", "")) + list(self.flags)
+        if self.link:
+            cmd += shlex.split(os.environ.get("LDFLAGS", ""))
+            cmd += [src, "-o", out] + list(getattr(self, "libs", ()))
+        else:
+            cmd += ["-c", src, "-o", out + ".o"]
+        return cmd
+
+    def _digest(self, buildconfig):
+        import hashlib
+        cmd = self._command(buildconfig)
+        exe = which(cmd[0])
+        data = repr((self.source, cmd, exe and _file_fingerprint(exe)))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def fingerprint(self, buildconfig):
+        return self._digest(buildconfig)
+
+    def cacheable(self, buildconfig):
+        return buildconfig.tool_results.get(self.name, ("no",))[0] == "yes"
+
+    def _compile(self, buildconfig):
+        import tempfile
+        with tempfile.TemporaryDirectory(prefix="conftest.") as tmp:
+            with open(os.path.join(tmp, "conftest.c"), "w") as f:
+                f.write(self.source)
+            return run_probe(self._command(buildconfig, tmp)).returncode == 0
+
+    def check(self, buildconfig):
+        # Identical checks from different tools are compiled once.
+        key = ("compile", self._digest(buildconfig))
+        # Not shared through the probe daemon: installing a missing
+        # header or library would not invalidate a "no".
+        ok = buildconfig._memoize(
+            key, lambda: self._compile(buildconfig), shared=False
+        )
+        buildconfig._set_tool(self.name, "yes" if ok else "no")
+        return ok or not self.required
+
+
+def _have_name(what):
+    import re
+    return "have_" + re.sub(r"[^a-z0-9]+", "_", what.lower()).strip("_")
+
+
+class HeaderCheck(CompileCheck):
+    def __init__(self, header, name=None, required=False):
+        super().__init__(name or _have_name(header), required)
+        self.source = f"#include <{header}>\nint main(void) {{ return 0; }}\n"
+
+
+class LibraryCheck(CompileCheck):
+    link = True
+
+    def __init__(self, library, function, name=None, required=False):
+        super().__init__(name or _have_name("lib" + library), required)
+        self.libs = [f"-l{library}"]
+        self.source = (
+            f"char {function}(void);\n"
+            f"int main(void) {{ return {function}(); }}\n"
+        )
+
+
+class CompilerFlagCheck(CompileCheck):
+    def __init__(self, flag, name=None, required=False):
+        super().__init__(name or _have_name("flag" + flag), required)
+        self.flags = ["-Werror", flag]
+
+
+class PkgConfigTool(Tool):
+    """
+    Resolves a set of pkg-config modules, given as a dict from module
+    name to a semver version spec (or None), and writes their versions
+    and the combined cflags and libs into config.mk as
+    <name>_<module>_version, <name>_cflags and <name>_libs.
+
+    All modules are resolved with three pkg-config invocations, which
+    run concurrently, no matter how many modules there are.  A module
+    that does not match its spec fails the check with ToolVersionError.
+    """
+
+    cache_env = ("PKG_CONFIG", "PKG_CONFIG_PATH", "PKG_CONFIG_LIBDIR")
+
+    def __init__(self, modules, name="pkg_config"):
+        self.modules = dict(modules)
+        self.name = name
+
+    def args(self, parser):
+        parser.add_argument(
+            f"--with-{self.name.replace('_', '-')}",
+            type=str,
+            help="name of the pkg-config executable",
+        )
+
+    def fingerprint(self, buildconfig):
+        return self.modules
+
+    def check(self, buildconfig):
+        import re
+        import shlex
+        import semver
+        pkgconfig = getattr(buildconfig.args, "with_" + self.name)
+        pkgconfig = pkgconfig or os.environ.get("PKG_CONFIG")
+        if pkgconfig is None:
+            for name in ("pkg-config", "pkgconf"):
+                if buildconfig.existence(name):
+                    pkgconfig = name
+                    break
+        if pkgconfig is None:
+            return False
+        cmd = shlex.split(pkgconfig)
+        if not buildconfig.existence(cmd[0]):
+            return False
+        modules = list(self.modules)
+        versions, cflags, libs = run_probes([
+            cmd + [query] + modules
+            for query in ("--modversion", "--cflags", "--libs")
+        ])
+        if versions.returncode != 0:
+            missing = [
+                m
+                for m in modules
+                if re.search(
+                    rf"Package '?{re.escape(m)}'?[ ,]", versions.stderr
+                )
+            ]
+            for m in missing or modules:
+                buildconfig._error(f"pkg-config module '{m}' not found")
+            return False
+        ok = True
+        for module, version in zip(modules, versions.stdout.split()):
+            spec = self.modules[module]
+            if spec is not None:
+                try:
+                    v = semver.Version.coerce(version)
+                except ValueError:
+                    v = None
+                if v is None or not semver.SimpleSpec(spec).match(v):
+                    buildconfig._version_error(
+                        f"pkg-config module '{module}' has version "
+                        f"'{version}', but we require '{spec}'"
+                    )
+                    ok = False
+            var = re.sub(r"[^A-Za-z0-9_]", "_", module)
+            buildconfig._add_make_variable(
+                f"{self.name}_{var}_version", version
+            )
+        buildconfig._add_make_variable(
+            f"{self.name}_cflags", cflags.stdout.strip()
+        )
+        buildconfig._add_make_variable(
+            f"{self.name}_libs", libs.stdout.strip()
+        )
+        buildconfig._set_tool(self.name, pkgconfig)
+        return ok
+
+
+def build_bundle(filename):
+    """
+    Write the zipapp 'filename' with talerbuildconfig and semver, as
+    source and precompiled for the running interpreter.  With the
+    bundle first in $PYTHONPATH, configure just unmarshals their code
+    instead of compiling it again on every run, even when the scripts
+    directory is read-only.  Running the bundle runs main().
+
+    If 'filename' is a directory, the bundle is written into it as
+    talerbuildconfig.<tag>.pyz, with the sys.implementation.cache_tag
+    of the running interpreter as <tag>.  The configure wrapper only
+    uses the bundle of its own interpreter, as others would have to
+    compile the source in the bundle on every run.  Returns the name
+    of the file written.
+    """
+    import py_compile
+    import shutil
+    import tempfile
+    import zipapp
+    here = os.path.dirname(os.path.abspath(__file__))
+    if os.path.isdir(filename):
+        tag = sys.implementation.cache_tag
+        filename = os.path.join(filename, f"talerbuildconfig.{tag}.pyz")
+    with tempfile.TemporaryDirectory(prefix="bundle.") as tmp:
+        src = os.path.join(tmp, "src")
+        os.mkdir(src)
+        for module in ("talerbuildconfig", "semver"):
+            source = os.path.join(src, module + ".py")
+            shutil.copyfile(os.path.join(here, module + ".py"), source)
+            # Next to the source, as zipimport does not look into
+            # __pycache__.  The pyc is not checked against the source,
+            # which cannot change inside the bundle.
+            py_compile.compile(
+                source,
+                cfile=os.path.join(src, module + ".pyc"),
+                doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            )
+        with open(os.path.join(src, "__main__.py"), "w") as f:
+            f.write("import talerbuildconfig\ntalerbuildconfig.main()\n")
+        dirname, basename = os.path.split(filename)
+        fd, target = tempfile.mkstemp(
+            dir=dirname or os.curdir, prefix=f".{basename}."
+        )
+        os.close(fd)
+        try:
+            zipapp.create_archive(
+                src, target, interpreter="/usr/bin/env python3"
+            )
+            os.chmod(target, 0o777 & ~_umask)
+            os.replace(target, filename)
+        except BaseException:
+            os.unlink(target)
+            raise
+    return filename
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python3 -m talerbuildconfig",
+        description="Helpers for configure scripts using talerbuildconfig",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.required = True
+    daemon = commands.add_parser(
+        "daemon", help="Run a probe daemon for --probe-daemon"
+    )
+    daemon.add_argument("socket", help="Unix socket to listen on")
+    bundle = commands.add_parser(
+        "bundle", help="Write a precompiled zipapp for the configure wrapper"
+    )
+    bundle.add_argument(
+        "output",
+        nargs="?",
+        default=os.curdir,
+        help="file or directory to write (default: %(default)s)",
+    )
+    update = commands.add_parser(
+        "inventory", help="Update an inventory.mk written by configure"
+    )
+    update.add_argument("file", help="inventory.mk to update")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "daemon":
+            serve_probes(args.socket)
+        elif args.command == "bundle":
+            print(f"writing {build_bundle(args.output)}")
+        elif args.command == "inventory":
+            update_inventory(args.file)
+    except OSError as e:
+        parser.exit(1, f"{parser.prog}: error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
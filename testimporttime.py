@@ -0,0 +1,96 @@
+# This file is part of TALER
+# (C) 2019 GNUnet e.V.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted.
+#
+# SPDX-License-Identifier: 0BSD
+
+"""
+Startup-time regression test for talerbuildconfig.
+
+Runs 'from talerbuildconfig import *' under 'python -X importtime' in
+a fresh interpreter, takes the cumulative import time of the
+talerbuildconfig module, and exits non-zero if it is over the budget.
+The first run only warms up the bytecode cache; the best of the
+following runs is compared against the budget.  Modules that must
+only be imported lazily are reported as failures as well.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that 'from talerbuildconfig import *' must not pull in.
+lazy = ["argparse", "asyncio", "json", "semver", "subprocess"]
+
+
+def import_time():
+    """
+    Return the cumulative import time of talerbuildconfig in
+    microseconds, and the names of all modules imported with it.
+    """
+    env = dict(os.environ, PYTHONPATH=here)
+    # Measure with a bytecode cache, as a normal configure run has.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    p = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            "from talerbuildconfig import *"
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    cumulative = None
+    modules = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        modules.append(name)
+        if name == "talerbuildconfig":
+            cumulative = int(fields[1])
+    if cumulative is None:
+        raise Exception("talerbuildconfig not found in -X importtime output")
+    return cumulative, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=15.0,
+        help="allowed import time of talerbuildconfig (milliseconds)",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="measured runs")
+    args = parser.parse_args()
+
+    import_time()
+    best, modules = min(import_time() for _ in range(args.runs))
+    ok = True
+    eager = [name for name in lazy if name in modules]
+    if eager:
+        print(f"FAIL: imported at module load: {', '.join(eager)}")
+        ok = False
+    if best / 1000 > args.budget:
+        print(
+            f"FAIL: import took {best / 1000:.1f}ms, budget {args.budget:.1f}ms"
+        )
+        ok = False
+    else:
+        print(f"import took {best / 1000:.1f}ms, budget {args.budget:.1f}ms")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()